@@ -1,23 +1,247 @@
 import argparse
+import asyncio
+import functools
 import json
 import logging
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
-import urllib.request
+import tempfile
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from urllib.error import HTTPError
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
 
+import aiofiles
+import aiohttp
 import coloredlogs
+import ijson
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class DownloadSuccess(NamedTuple):
+    url: str
+    download_file: str
+
+
+class DownloadFailure(NamedTuple):
+    url: str
+    download_file: str
+    reason: str
+
+
+DownloadResult = Union[DownloadSuccess, DownloadFailure]
+
+
+class Chapter(NamedTuple):
+    start_time: float
+    # None for the last chapter of a part, which runs to the end of the file
+    end_time: Optional[float]
+    chapter: str
+    track: int
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_timestamp(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def _read_json(filename: str):
+    if orjson:
+        return orjson.loads(Path(filename).read_bytes())
+    with open(filename, "r") as json_file:
+        return json.load(json_file)
+
+
+def _write_json(filename: str, data) -> None:
+    if orjson:
+        Path(filename).write_bytes(orjson.dumps(data))
+        return
+    with open(filename, "w") as json_file:
+        json.dump(data, json_file)
+
+
+def _execute_command(argv: list[str]) -> subprocess.CompletedProcess:
+    logger = logging.getLogger(__name__)
+    logger.info(f"Executing: {shlex.join(argv)}")
+    # ffmpeg reports progress and errors on stderr, so both streams are merged into stdout
+    result = subprocess.run(
+        argv,
+        encoding="utf-8",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        check=False,
+    )
+    logger.debug(result)
+    if result.returncode != 0:
+        logger.critical(f"ERROR: Error in command -> {result.stdout}")
+        sys.exit(1)
+    return result
+
+
+def _probe_duration(filename: str) -> float:
+    result = _execute_command(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            filename,
+        ]
+    )
+    return float(result.stdout.strip())
+
+
+def _write_concat_file(directory: str, filenames: list[str]) -> str:
+    concat_file = f"{directory}/concat.txt"
+    with open(concat_file, "w") as concat_list:
+        for filename in filenames:
+            quoted_file = os.path.abspath(filename).replace("'", "'\\''")
+            concat_list.write(f"file '{quoted_file}'\n")
+    return concat_file
+
+
+def _escape_ffmetadata(value: str) -> str:
+    return re.sub(r"([=;#\\\n])", r"\\\1", value)
+
+
+def _generate_chapter_file(
+    segment_file: str,
+    start_time: float,
+    chapter: Chapter,
+    output_file: str,
+    metadata: list[str],
+    done_set: frozenset[str],
+    existing_files: frozenset[str],
+) -> None:
+    logger = logging.getLogger(__name__)
+    if output_file in done_set:
+        logger.info(f"Skipping the {output_file} chapter, it was generated by a previous run")
+        return
+    logger.info(f"Generating the {output_file} chapter")
+    command = [
+        "ffmpeg",
+        *(["-ss", str(start_time)] if start_time > 0 else []),
+        "-i",
+        segment_file,
+        *metadata,
+        "-metadata",
+        f"title={chapter.chapter}",
+        "-metadata",
+        f"track={chapter.track}",
+        "-c",
+        "copy",
+        "-y",
+        # The outfile file must be the last argument in the command
+        output_file,
+    ]
+    if os.path.basename(output_file) in existing_files:
+        logger.warning(f"The {output_file} chapter file has already been generated")
+    _execute_command(command)
+
+
+def _split_chapter_files(
+    filename: str,
+    chapters: list[Chapter],
+    download_directory: str,
+    name: str,
+    metadata: list[str],
+    silence_padding: float,
+    done_set: frozenset[str],
+    existing_files: frozenset[str],
+) -> None:
+    # Module level (rather than an AudioBooker method) so it can be pickled for the process pool
+    logger = logging.getLogger(__name__)
+    output_files = [f"{download_directory}/{name}_{chapter.chapter}.mp3" for chapter in chapters]
+    if done_set.issuperset(output_files):
+        logger.info(f"Skipping the {filename} file, all of its chapters were generated by a previous run")
+        return
+    if len(chapters) == 1:
+        _generate_chapter_file(
+            segment_file=filename,
+            start_time=0.0,
+            chapter=chapters[0],
+            output_file=output_files[0],
+            metadata=metadata,
+            done_set=done_set,
+            existing_files=existing_files,
+        )
+        return
+
+    logger.info(f"Splitting the {filename} file into {len(chapters)} chapters")
+    # Each split lands inside the silence, leaving the padding at the end of every chapter
+    segment_times = ",".join(str(chapter.end_time + silence_padding) for chapter in chapters[:-1])
+    with tempfile.TemporaryDirectory(dir=download_directory) as segment_directory:
+        # A single stream copy pass writes every chapter of the file instead of one re-read per chapter
+        _execute_command(
+            [
+                "ffmpeg",
+                "-i",
+                filename,
+                "-f",
+                "segment",
+                "-segment_times",
+                segment_times,
+                "-reset_timestamps",
+                "1",
+                "-map",
+                "0:a",
+                "-c",
+                "copy",
+                f"{segment_directory}/%03d.mp3",
+            ]
+        )
+        for index, (chapter, output_file) in enumerate(zip(chapters, output_files)):
+            # Segments begin at the previous split point, so the rest of that silence is trimmed off the start to
+            # leave the same padding before the chapter as after it
+            leading_trim = 0.0
+            if index:
+                leading_trim = (chapter.start_time - silence_padding) - (chapters[index - 1].end_time + silence_padding)
+            _generate_chapter_file(
+                segment_file=f"{segment_directory}/{index:03d}.mp3",
+                start_time=leading_trim,
+                chapter=chapter,
+                output_file=output_file,
+                metadata=metadata,
+                done_set=done_set,
+                existing_files=existing_files,
+            )
 
 
 class AudioBooker:
-    def __init__(self) -> None:
-        self._args = self._process_args()
+    _SILENCE_START_RE = re.compile(r"silence_start: ([\d.]+)")
+    _SILENCE_END_RE = re.compile(r"silence_end: ([\d.]+) \| silence_duration: ([\d.]+)")
+    _FILENAME_RE = re.compile(r"\w+")
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self._args = args
         self._logger = logging.getLogger(__name__)
-        # Configure coloredlogs
+        self._metadata = self._build_metadata()
+        self._download_directory = "download"
+        self._silence_cache_file = f"{self._download_directory}/{self._args.name}_silences.json"
+        self._chapter = 0
+        self._track = 0
+        self._introduction_processed = False
+        self._prologue_processed = False
+        # This is used to add silence to the ends of each chapter for a better listening experience
+        self._silence_padding = self._args.silence_duration_threshold / 2
+
+    @classmethod
+    def from_cli(cls) -> "AudioBooker":
+        return cls(args=cls._process_args())
+
+    def _configure_logging(self) -> None:
         coloredlogs.install(
             level=self._args.log_level,
             fmt=r"{asctime:s} | {levelname:^8s} | {name:s} | {module:s}:{funcName:s}:{lineno:d} | {message:s}",
@@ -39,17 +263,9 @@ class AudioBooker:
                 "lineno": {"color": "cyan"},
             },
         )
-        self._metadata = self._build_metadata()
-        self._download_directory = "download"
-        self._logger.debug(f"Ensuring the {self._download_directory} directory exists")
-        self._chapter = 0
-        self._introduction_processed = False
-        self._prologue_processed = False
-        # This is used to add silence to the ends of each chapter for a better listening experience
-        self._silence_padding = self._args.silence_duration_threshold / 2
-        Path(self._download_directory).mkdir(parents=True, exist_ok=True)
 
-    def _process_args(self):
+    @staticmethod
+    def _process_args() -> argparse.Namespace:
         parser = argparse.ArgumentParser(description="Example script to demonstrate command-line argument parsing.")
         # Define command-line arguments
         parser.add_argument("--name", type=str, help="The name of the book", required=True)
@@ -111,177 +327,537 @@ class AudioBooker:
             help="The length, in seconds, that a silence should be considered. This is helpful to remove trailing silences from a audio file.",
             default=5,
         )
+        parser.add_argument(
+            "--max_concurrent",
+            type=int,
+            help="The maximum number of MP3 files to download at the same time",
+            default=6,
+        )
+        parser.add_argument(
+            "--max_workers",
+            type=int,
+            help="The maximum number of ffmpeg processes to run at the same time",
+            default=os.cpu_count(),
+        )
+        parser.add_argument(
+            "--parallel_chunks",
+            type=int,
+            help="The number of concurrent range requests to split each MP3 file download into",
+            default=1,
+        )
+        parser.add_argument(
+            "--single_file",
+            action="store_true",
+            help="Generate a single MP3 file with embedded chapter markers instead of one MP3 file per chapter",
+        )
 
         # Parse the arguments
         return parser.parse_args()
 
-    def _build_metadata(self) -> str:
-        metadata = f'-metadata album="{self._args.title}" -metadata author="{self._args.author}" -metadata album_artist="{self._args.author}"'
+    def _build_metadata(self) -> list[str]:
+        metadata = [
+            "-metadata",
+            f"album={self._args.title}",
+            "-metadata",
+            f"author={self._args.author}",
+            "-metadata",
+            f"album_artist={self._args.author}",
+        ]
         if self._args.composer:
-            metadata += f' -metadata composer="{self._args.composer}"'
+            metadata += ["-metadata", f"composer={self._args.composer}"]
         return metadata
 
-    def _execute_command(self, command: str) -> subprocess.CompletedProcess:
-        self._logger.info(f"Executing: {command}")
-        result = subprocess.run(
-            [command],
-            shell=True,
-            encoding="utf-8",
-            capture_output=True,
-        )
-        self._logger.debug(result)
-        if result.returncode != 0:
-            self._logger.critical(f"ERROR: Error in command -> {result.stderr}")
-            sys.exit(1)
-        return result
-
-    def _detect_silences(self, filename: str) -> list[tuple[str]]:
+    def _detect_silences(self, filename: str) -> list[tuple[str, str]]:
         self._logger.info(f"Attempting to parse timestamps for silences between chapters from the {filename} file")
-        # output is in stderr, so it needs to be piped to stdout (2>&1)
-        command = f'ffmpeg -i "{filename}" -af silencedetect=n={self._args.silence_db_threshold}dB:d={self._args.silence_duration_threshold} -f null - 2>&1'
+        command = [
+            "ffmpeg",
+            "-i",
+            filename,
+            "-af",
+            f"silencedetect=n={self._args.silence_db_threshold}dB:d={self._args.silence_duration_threshold}",
+            "-f",
+            "null",
+            "-",
+        ]
 
-        result = self._execute_command(command=command)
+        result = _execute_command(command)
         self._logger.debug(f"Locating silence timestamps from output:\n{result.stdout}")
 
-        timestamps = re.findall(
-            r"^\[silencedetect.*silence_start: ([\d\.]+)\n\[silencedetect.+silence_end: ([\d\.]+) \| silence_duration: ([\d\.]+)",
-            result.stdout,
-            re.MULTILINE,
-        )
-        # Filter out any silences that exceed the maximum threshold
-        timestamps = [(ts[0], ts[1]) for ts in timestamps if float(ts[2]) < float(self._args.maximum_silence)]
-        self._logger.info(f"Located silence time periods -> {timestamps}")
+        maximum_silence = float(self._args.maximum_silence)
+        timestamps = []
+        silence_start = None
+        # splitlines also breaks on the carriage returns that ffmpeg ends its progress lines with
+        for line in result.stdout.splitlines():
+            if not line.startswith("[silencedetect"):
+                continue
+            if start_match := self._SILENCE_START_RE.search(line):
+                silence_start = start_match.group(1)
+            elif (end_match := self._SILENCE_END_RE.search(line)) and silence_start is not None:
+                # Filter out any silences that exceed the maximum threshold
+                if float(end_match.group(2)) < maximum_silence:
+                    timestamps.append((silence_start, end_match.group(1)))
+                silence_start = None
+        self._logger.info(f"Located silence time periods for the {filename} file -> {timestamps}")
         return timestamps
 
-    def _load_har_file(self) -> dict:
-        self._logger.info(f"Loading data from the {self._args.har_file} HAR file")
-        with open(self._args.har_file, "r") as libby_har:
-            loaded_har_file = json.load(libby_har)
-            self._logger.debug(f"Loaded HAR data:\n{loaded_har_file}")
-            return loaded_har_file
+    def _load_har_entries(self) -> Iterator[dict]:
+        self._logger.info(f"Streaming entries from the {self._args.har_file} HAR file")
+        # HAR files are mostly response bodies that are never used, so only one entry is held in memory at a time
+        with open(self._args.har_file, "rb") as libby_har:
+            yield from ijson.items(libby_har, "log.entries.item")
+
+    def _load_media_links(self) -> list[str]:
+        # The ordered links are cached next to the HAR file so reruns can skip parsing it
+        har_stat = os.stat(self._args.har_file)
+        cache_key = f"{har_stat.st_mtime_ns}_{har_stat.st_size}"
+        cache_file = f"{self._args.har_file}.linkcache.json"
+        if os.path.isfile(cache_file):
+            try:
+                cached_links = _read_json(cache_file)
+                if cached_links["key"] == cache_key:
+                    self._logger.info(f"Using the cached MP3 download URLS from the {cache_file} file")
+                    return cached_links["links"]
+                self._logger.debug(f"The {cache_file} file is stale")
+            except (ValueError, KeyError):
+                self._logger.warning(f"Ignoring the invalid {cache_file} file")
+
+        ordered_media_links = self._identify_download_urls(har_entries=self._load_har_entries())
+        _write_json(cache_file, {"key": cache_key, "links": ordered_media_links})
+        return ordered_media_links
 
-    def _identify_download_urls(self, loaded_har_file: dict) -> list[str]:
-        self._logger.info("Attempting to parse the MP3 download URLS from the loaded HAR file")
+    def _identify_download_urls(self, har_entries: Iterable[dict]) -> list[str]:
+        self._logger.info("Attempting to parse the MP3 download URLS from the HAR file")
         located_media_links = {}
-        for libby_entry in loaded_har_file["log"]["entries"]:
-            if libby_entry["_resourceType"] != "media":
-                self._logger.debug(f"Skipping non-media resource: {libby_entry['_resourceType']}")
+        for libby_entry in har_entries:
+            if libby_entry.get("_resourceType") != "media":
+                self._logger.debug(f"Skipping non-media resource: {libby_entry.get('_resourceType')}")
                 continue
             if "odrmediaclips.cachefly.net" not in libby_entry["request"]["url"]:
                 self._logger.debug(f"Skipping invalid URL: {libby_entry['request']['url']}")
                 continue
-            query_timestamp = datetime.fromisoformat(libby_entry["startedDateTime"].replace("Z", "+00:00"))
-            if (timestamp := located_media_links.get(libby_entry["request"]["url"])) and query_timestamp < timestamp:
-                self._logger.debug(f"Skipping older timestamp: {libby_entry['startedDateTime']}")
+            query_timestamp = libby_entry["startedDateTime"]
+            # Timestamps are kept as strings and only parsed when a URL shows up more than once
+            timestamp = located_media_links.get(libby_entry["request"]["url"])
+            if timestamp and _parse_timestamp(query_timestamp) < _parse_timestamp(timestamp):
+                self._logger.debug(f"Skipping older timestamp: {query_timestamp}")
                 continue
             self._logger.debug(f"Appending URL: {libby_entry['request']['url']}")
             located_media_links[libby_entry["request"]["url"]] = query_timestamp
 
         # Create a list of names ordered by their timestamps
         # This ensures that the parts are sorted so that the identified chapters are in order
-        ordered_media_links = [name for name, _ in sorted(located_media_links.items(), key=lambda item: item[1])]
+        # The dict keeps first-seen order and HAR entries are usually chronological, so this is a linear pass
+        ordered_media_links = sorted(located_media_links, key=lambda url: _parse_timestamp(located_media_links[url]))
         self._logger.debug(f"Ordered URL list: {ordered_media_links}")
 
         return ordered_media_links
 
-    def _download_audiobook_files(self, located_media_links: list) -> list[str]:
-        downloaded_files = []
+    async def _download_audiobook_file_async(
+        self,
+        session: aiohttp.ClientSession,
+        semaphore: asyncio.Semaphore,
+        media_link: str,
+        download_file: str,
+        existing_files: set[str],
+    ) -> DownloadResult:
+        if os.path.basename(download_file) in existing_files:
+            self._logger.warning(f"The {download_file} file has already been downloaded")
+            return DownloadSuccess(url=media_link, download_file=download_file)
+        # Stream into a partial file so an interrupted download is never mistaken for a completed one
+        partial_file = f"{download_file}.partial"
+        async with semaphore:
+            self._logger.info(f"Downloading from: {media_link} to {download_file}")
+            try:
+                content_length, accepts_ranges = await self._probe_download_async(
+                    session=session, media_link=media_link
+                )
+                if self._args.parallel_chunks > 1 and content_length and accepts_ranges:
+                    await self._download_chunked_async(
+                        session=session, media_link=media_link, partial_file=partial_file, content_length=content_length
+                    )
+                else:
+                    await self._download_resumable_async(
+                        session=session, media_link=media_link, partial_file=partial_file, content_length=content_length
+                    )
+            except aiohttp.ClientResponseError as error:
+                self._logger.error(
+                    f"The download link for the {download_file} file is expired. Regenerate a new HAR file."
+                )
+                return DownloadFailure(url=media_link, download_file=download_file, reason=str(error))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                self._logger.error(f"Network error while downloading {download_file} -> {error!r}")
+                return DownloadFailure(url=media_link, download_file=download_file, reason=repr(error))
+            except Exception as error:
+                self._logger.exception(f"Unhandled error while downloading {download_file}")
+                return DownloadFailure(url=media_link, download_file=download_file, reason=str(error))
+        downloaded_size = os.path.getsize(partial_file)
+        if content_length and downloaded_size != content_length:
+            self._logger.error(
+                f"Downloaded {downloaded_size} of {content_length} bytes for the {download_file} file, "
+                "rerun the script to resume it"
+            )
+            return DownloadFailure(
+                url=media_link,
+                download_file=download_file,
+                reason=f"Downloaded {downloaded_size} of {content_length} bytes",
+            )
+        os.replace(partial_file, download_file)
+        existing_files.add(os.path.basename(download_file))
+        return DownloadSuccess(url=media_link, download_file=download_file)
+
+    async def _probe_download_async(
+        self, session: aiohttp.ClientSession, media_link: str
+    ) -> tuple[Optional[int], bool]:
+        try:
+            async with session.head(media_link, allow_redirects=True, raise_for_status=True) as response:
+                return response.content_length, response.headers.get("Accept-Ranges") == "bytes"
+        except aiohttp.ClientResponseError as error:
+            # Some CDNs and signed URLs reject HEAD even though GET works, so the size is just treated as unknown
+            self._logger.debug(f"Unable to HEAD {media_link} ({error.status}), downloading it without resume support")
+            return None, False
+
+    async def _download_range_async(
+        self, session: aiohttp.ClientSession, media_link: str, download_file: str, start: int, end: Optional[int]
+    ) -> None:
+        # Anything already on disk from an earlier attempt is kept, and only the rest of the range is requested
+        existing_size = os.path.getsize(download_file) if os.path.isfile(download_file) else 0
+        if end is not None and existing_size > end - start + 1:
+            self._logger.warning(f"The {download_file} file is larger than its range, restarting it")
+            existing_size = 0
+        range_start = start + existing_size
+        if end is not None:
+            if range_start > end:
+                return
+            headers = {"Range": f"bytes={range_start}-{end}"}
+        elif range_start:
+            headers = {"Range": f"bytes={range_start}-"}
+        else:
+            headers = {}
+        async with session.get(media_link, headers=headers, raise_for_status=True) as response:
+            if headers and response.status != 206:
+                if end is not None:
+                    raise IOError(f"The server ignored the range request for {media_link}")
+                # The whole file was sent, so start over rather than appending it to the existing bytes
+                self._logger.warning(f"Unable to resume {download_file}, restarting the download")
+                existing_size = 0
+            async with aiofiles.open(download_file, "ab" if existing_size else "wb") as audio_file:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    await audio_file.write(chunk)
+
+    async def _download_resumable_async(
+        self, session: aiohttp.ClientSession, media_link: str, partial_file: str, content_length: Optional[int]
+    ) -> None:
+        if content_length is None:
+            # Without a known size a finished partial file can't be told apart from an interrupted one
+            if os.path.isfile(partial_file):
+                self._logger.warning(f"The size of {partial_file} can't be checked, restarting the download")
+                os.remove(partial_file)
+        elif os.path.isfile(partial_file) and os.path.getsize(partial_file) > content_length:
+            self._logger.warning(f"The {partial_file} file is larger than expected, restarting the download")
+            os.remove(partial_file)
+        if os.path.isfile(partial_file):
+            if os.path.getsize(partial_file) == content_length:
+                return
+            self._logger.info(f"Resuming {partial_file} from byte {os.path.getsize(partial_file)}")
+        await self._download_range_async(
+            session=session, media_link=media_link, download_file=partial_file, start=0, end=None
+        )
+
+    async def _download_chunked_async(
+        self, session: aiohttp.ClientSession, media_link: str, partial_file: str, content_length: int
+    ) -> None:
+        if os.path.isfile(partial_file) and os.path.getsize(partial_file) == content_length:
+            return
+        chunk_size = -(-content_length // self._args.parallel_chunks)
+        chunk_ranges = [
+            # The chunk count is part of the name so chunks from a run with a different --parallel_chunks are not reused
+            (f"{partial_file}.{self._args.parallel_chunks}.{index}", start, min(start + chunk_size, content_length) - 1)
+            for index, start in enumerate(range(0, content_length, chunk_size))
+        ]
+        chunk_tasks = [
+            asyncio.create_task(
+                self._download_range_async(
+                    session=session, media_link=media_link, download_file=chunk_file, start=start, end=end
+                )
+            )
+            for chunk_file, start, end in chunk_ranges
+        ]
+        try:
+            await asyncio.gather(*chunk_tasks)
+        except BaseException:
+            # The part has failed, so the other chunks are stopped rather than left holding connections. The original
+            # error is re-raised instead of an ExceptionGroup so the caller still reports it by type.
+            for chunk_task in chunk_tasks:
+                chunk_task.cancel()
+            await asyncio.gather(*chunk_tasks, return_exceptions=True)
+            raise
+        await asyncio.to_thread(self._join_files, partial_file, [chunk_file for chunk_file, _, _ in chunk_ranges])
+
+    @staticmethod
+    def _join_files(output_file: str, input_files: list[str]) -> None:
+        with open(output_file, "wb") as joined_file:
+            for input_file in input_files:
+                with open(input_file, "rb") as chunk_file:
+                    shutil.copyfileobj(chunk_file, joined_file)
+        for input_file in input_files:
+            os.remove(input_file)
+
+    async def _download_audiobook_files_async(self, located_media_links: list, existing_files: set[str]) -> list[str]:
         self._logger.info(f"Attempting to download the MP3 files from the {self._args.har_file} HAR file")
         self._logger.debug(f"Downloading: {json.dumps(list(located_media_links), indent=4)}")
+        # Keyed by the download file since a part requested again with a fresh signature must only be downloaded once.
+        # The links are in timestamp order, so the newest link wins while the part keeps its first position.
+        download_requests = {}
         for media_link in located_media_links:
-            re_match = re.search(r"\/(\w+)$", media_link)
-            if not re_match:
+            filename = urllib.parse.urlsplit(media_link).path.rpartition("/")[2]
+            if not self._FILENAME_RE.fullmatch(filename):
                 self._logger.error(f"Unable to parse filename from {media_link}")
                 continue
-            filename = re_match.group(1)
             self._logger.info(f"Parsed filename {filename} from URL")
-            download_file = f"{self._download_directory}/{self._args.name}_{filename}.mp3"
-            if os.path.isfile(download_file):
-                self._logger.warning(f"The {download_file} file has already been downloaded")
-                downloaded_files.append(download_file)
-                continue
-            self._logger.info(f"Downloading from: {media_link} to {download_file}")
-            try:
-                urllib.request.urlretrieve(media_link, download_file)
-                downloaded_files.append(download_file)
-            except HTTPError:
-                self._logger.error(
-                    f"The download link for the {download_file} file is expired. Regenerate a new HAR file."
+            download_requests[f"{self._download_directory}/{self._args.name}_{filename}.mp3"] = media_link
+
+        semaphore = asyncio.Semaphore(self._args.max_concurrent)
+        # A single session keeps the CDN connections (and their TLS sessions) alive between parts
+        connector = aiohttp.TCPConnector(
+            limit=self._args.max_concurrent * self._args.parallel_chunks, keepalive_timeout=30
+        )
+        # No total timeout since large parts can take a while, but stalled connections and reads are abandoned
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            # gather preserves the request order, which keeps the parts ordered for chapter identification
+            results = await asyncio.gather(
+                *(
+                    self._download_audiobook_file_async(
+                        session=session,
+                        semaphore=semaphore,
+                        media_link=media_link,
+                        download_file=download_file,
+                        existing_files=existing_files,
+                    )
+                    for download_file, media_link in download_requests.items()
                 )
-            except Exception:
-                self._logger.exception(f"Unhandled error while downloading {download_file}")
-        return downloaded_files
-
-    def _generate_chapter_file(self, filename: str, start_time: int, end_time: int, chapter: str) -> None:
-        output_file = f"{self._download_directory}/{self._args.name}_{chapter}.mp3"
-        self._logger.info(f"Generating the {output_file} chapter")
-        metadata = f'{self._metadata} -metadata title="{chapter}" -metadata track="{chapter}"'
-        command = f'ffmpeg -i "{filename}" {metadata} -c copy -y'
-        if start_time:
-            command += f" -ss {float(start_time) - self._silence_padding}"
-        if end_time:
-            command += f" -to {float(end_time) + self._silence_padding}"
-        # The outfile file must be the last argument in the command
-        command += f' "{output_file}"'
-        if os.path.isfile(output_file):
-            self._logger.warning(f"The {output_file} chapter file has already been generated")
-        self._execute_command(command=command)
+            )
+        return [result.download_file for result in results if isinstance(result, DownloadSuccess)]
+
+    def _silence_cache_key(self, filename: str) -> str:
+        # The detection settings are part of the key so that tuning them on a rerun invalidates the cache
+        file_stat = os.stat(filename)
+        return (
+            f"{file_stat.st_mtime_ns}_{file_stat.st_size}_{self._args.silence_db_threshold}"
+            f"_{self._args.silence_duration_threshold}_{self._args.maximum_silence}"
+        )
+
+    def _chapter_settings(self, downloaded_files: list[str]) -> list:
+        # Track numbers run across the parts in order, so the parts are part of the settings
+        return [
+            downloaded_files,
+            self._args.has_introduction,
+            self._args.has_prologue,
+            self._args.has_epilogue,
+            self._args.has_conclusion,
+            self._args.single_file,
+            self._metadata,
+        ]
+
+    def _load_silence_cache(self) -> dict:
+        if not os.path.isfile(self._silence_cache_file):
+            return {}
+        try:
+            return _read_json(self._silence_cache_file)
+        except ValueError:
+            self._logger.warning(f"Ignoring the invalid {self._silence_cache_file} file")
+            return {}
+
+    def _save_silence_cache(self, silence_timestamps: dict, chapter_settings: Optional[list]) -> None:
+        _write_json(
+            self._silence_cache_file,
+            {
+                "chapter_settings": chapter_settings,
+                "files": {
+                    filename: {"key": self._silence_cache_key(filename), "silences": timestamps}
+                    for filename, timestamps in silence_timestamps.items()
+                },
+            },
+        )
+
+    def _generate_audiobook_file(
+        self, downloaded_files: list[str], chapters: list[list[Chapter]], durations: list[float]
+    ) -> None:
+        output_file = f"{self._download_directory}/{self._args.name}.mp3"
+        self._logger.info(f"Generating the {output_file} audiobook with {sum(map(len, chapters))} chapters")
+        chapter_markers = []
+        file_offset = 0.0
+        for file_chapters, duration in zip(chapters, durations):
+            chapter_start = 0.0
+            for chapter in file_chapters:
+                # Chapters end at the same split points used for the per-chapter files
+                chapter_end = duration if chapter.end_time is None else chapter.end_time + self._silence_padding
+                chapter_markers += [
+                    "[CHAPTER]",
+                    "TIMEBASE=1/1000",
+                    f"START={round((file_offset + chapter_start) * 1000)}",
+                    f"END={round((file_offset + chapter_end) * 1000)}",
+                    f"title={_escape_ffmetadata(chapter.chapter)}",
+                ]
+                chapter_start = chapter_end
+            file_offset += duration
+
+        with tempfile.TemporaryDirectory(dir=self._download_directory) as work_directory:
+            concat_file = _write_concat_file(work_directory, downloaded_files)
+            chapters_file = f"{work_directory}/chapters.ffmeta"
+            with open(chapters_file, "w") as ffmetadata:
+                ffmetadata.write("\n".join([";FFMETADATA1", *chapter_markers]) + "\n")
+            # The parts are joined and the chapter markers written in a single stream copy
+            _execute_command(
+                [
+                    "ffmpeg",
+                    "-f",
+                    "concat",
+                    "-safe",
+                    "0",
+                    "-i",
+                    concat_file,
+                    "-i",
+                    chapters_file,
+                    "-map",
+                    "0:a",
+                    "-map_chapters",
+                    "1",
+                    *self._metadata,
+                    "-metadata",
+                    f"title={self._args.title}",
+                    "-c",
+                    "copy",
+                    "-y",
+                    # The outfile file must be the last argument in the command
+                    output_file,
+                ]
+            )
 
-    def _identify_chapters(self, filename: str, silence_timestamps: tuple[str], is_last_file: bool) -> None:
+    def _next_track(self) -> int:
+        self._track += 1
+        return self._track
+
+    def _identify_chapters(
+        self, filename: str, silence_timestamps: list[tuple[str, str]], is_last_file: bool
+    ) -> list[Chapter]:
         self._logger.info(f"Attempting to parse chapters from the {filename} file")
 
-        next_chapter_start_time = 0
-        for silence_timestamp in silence_timestamps:
+        has_introduction = self._args.has_introduction
+        has_prologue = self._args.has_prologue
+        has_conclusion = self._args.has_conclusion
+        # Compared by position so that a duplicated timestamp can't trigger the epilogue early
+        last_index = len(silence_timestamps) - 1
+        chapters = []
+        next_chapter_start_time = 0.0
+        for index, silence_timestamp in enumerate(silence_timestamps):
             self._logger.debug(f"Processing silence timestamp: {silence_timestamp}")
-            silence_start, silence_end = silence_timestamp
-            if self._args.has_introduction and not self._introduction_processed:
+            silence_start, silence_end = (float(timestamp) for timestamp in silence_timestamp)
+            if has_introduction and not self._introduction_processed:
                 chapter = "Introduction"
                 self._introduction_processed = True
-            elif self._args.has_prologue and not self._prologue_processed:
+            elif has_prologue and not self._prologue_processed:
                 chapter = "Prologue"
                 self._prologue_processed = True
             # If the last chapter WITH a conclusion following in the LAST downloaded file
-            elif silence_timestamp == silence_timestamps[-1] and self._args.has_conclusion and is_last_file:
+            elif index == last_index and has_conclusion and is_last_file:
                 chapter = "Epilogue"
             else:
                 self._chapter += 1
                 chapter = f"Chapter {self._chapter}"
-            self._generate_chapter_file(
-                filename=filename,
-                start_time=next_chapter_start_time,
-                end_time=silence_start,
-                chapter=chapter,
+            chapters.append(
+                Chapter(
+                    start_time=next_chapter_start_time,
+                    end_time=silence_start,
+                    chapter=chapter,
+                    track=self._next_track(),
+                )
             )
             next_chapter_start_time = silence_end
         # This captures all of the audio AFTER the last detected silence, which should be the rest of a MP3 file
         if is_last_file:
-            if self._args.has_conclusion:
+            if has_conclusion:
                 chapter = "Conclusion"
             else:
                 chapter = "Epilogue"
         else:
             self._chapter += 1
             chapter = f"Chapter {self._chapter}"
-        self._generate_chapter_file(
-            filename=filename,
-            start_time=next_chapter_start_time,
-            end_time=0,
-            chapter=chapter,
+        chapters.append(
+            Chapter(
+                start_time=next_chapter_start_time,
+                end_time=None,
+                chapter=chapter,
+                track=self._next_track(),
+            )
         )
+        return chapters
 
     def execute(self):
+        self._configure_logging()
         self._logger.info(f"Generating MP3 files for the {self._args.name} Audiobook")
-        loaded_har_file = self._load_har_file()
-        located_media_links = self._identify_download_urls(loaded_har_file=loaded_har_file)
-        downloaded_files = self._download_audiobook_files(located_media_links=located_media_links)
+        self._logger.debug(f"Ensuring the {self._download_directory} directory exists")
+        Path(self._download_directory).mkdir(parents=True, exist_ok=True)
+        # A single listing of the download directory answers every "does this file exist" check for the run
+        with os.scandir(self._download_directory) as entries:
+            existing_files = {entry.name for entry in entries}
+        located_media_links = self._load_media_links()
+        downloaded_files = asyncio.run(
+            self._download_audiobook_files_async(located_media_links=located_media_links, existing_files=existing_files)
+        )
+        cached_silences = self._load_silence_cache()
+        silence_timestamps = {}
         for downloaded_file in downloaded_files:
-            silence_timestamps = self._detect_silences(filename=downloaded_file)
-            self._identify_chapters(
-                filename=downloaded_file,
-                silence_timestamps=silence_timestamps,
-                is_last_file=self._args.has_epilogue and downloaded_file == downloaded_files[-1],
+            cached_file = cached_silences.get("files", {}).get(downloaded_file, {})
+            if cached_file.get("key") == self._silence_cache_key(downloaded_file):
+                self._logger.info(f"Using the cached silence timestamps for the {downloaded_file} file")
+                silence_timestamps[downloaded_file] = [tuple(timestamp) for timestamp in cached_file["silences"]]
+        pending_files = [filename for filename in downloaded_files if filename not in silence_timestamps]
+        # Existing chapter files are only reused when they were cut from the same silences with the same settings
+        chapter_settings = self._chapter_settings(downloaded_files)
+        if not pending_files and cached_silences.get("chapter_settings") == chapter_settings:
+            done_set = frozenset(
+                f"{self._download_directory}/{existing_file}"
+                for existing_file in existing_files
+                if existing_file.startswith(f"{self._args.name}_") and existing_file.endswith(".mp3")
             )
+        else:
+            done_set = frozenset()
+
+        with ProcessPoolExecutor(max_workers=self._args.max_workers) as executor:
+            # One ffmpeg per part, run in parallel across the workers
+            silence_timestamps.update(zip(pending_files, executor.map(self._detect_silences, pending_files)))
+            self._save_silence_cache(silence_timestamps=silence_timestamps, chapter_settings=None)
+            # Chapter naming depends on the files before it, so the plan is built in order before any slicing
+            chapters = [
+                self._identify_chapters(
+                    filename=downloaded_file,
+                    silence_timestamps=silence_timestamps[downloaded_file],
+                    is_last_file=self._args.has_epilogue and downloaded_file == downloaded_files[-1],
+                )
+                for downloaded_file in downloaded_files
+            ]
+            if self._args.single_file and not downloaded_files:
+                self._logger.warning("No MP3 files were downloaded, skipping the audiobook file generation")
+            elif self._args.single_file:
+                durations = list(executor.map(_probe_duration, downloaded_files))
+                self._generate_audiobook_file(downloaded_files=downloaded_files, chapters=chapters, durations=durations)
+            else:
+                split_chapter_files = functools.partial(
+                    _split_chapter_files,
+                    download_directory=self._download_directory,
+                    name=self._args.name,
+                    metadata=self._metadata,
+                    silence_padding=self._silence_padding,
+                    done_set=done_set,
+                    existing_files=frozenset(existing_files),
+                )
+                # Consume the results so that any worker failure is raised here
+                list(executor.map(split_chapter_files, downloaded_files, chapters))
+        # Only recorded once every chapter is written, so a failed run never marks partial chapter files as done
+        self._save_silence_cache(silence_timestamps=silence_timestamps, chapter_settings=chapter_settings)
 
 
-ab = AudioBooker()
-ab.execute()
+# The guard keeps the module importable, and stops process pool workers from re-running the script
+if __name__ == "__main__":
+    AudioBooker.from_cli().execute()